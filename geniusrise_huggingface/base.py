@@ -13,17 +13,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import logging
 import os
+import shutil
+import sqlite3
+import tempfile
 from abc import abstractmethod
-from typing import Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Union
 
 import numpy as np
-from datasets import Dataset, DatasetDict
+import pandas as pd
+import pyarrow as pa
+from adbc_driver_sqlite import dbapi as adbc_sqlite
+from datasets import Dataset, DatasetDict, load_from_disk
 from geniusrise import BatchInput, BatchOutput, Bolt, State
+from pyarrow import parquet as pq
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 from transformers import EvalPrediction, Trainer, TrainingArguments, AutoConfig
 
+# Dataset formats that are slow to parse and worth converting to parquet once
+NORMALIZABLE_FORMATS = (".xls", ".xlsx", ".xml", ".yaml", ".yml")
+
 
 class HuggingFaceFineTuner(Bolt):
     """
@@ -90,6 +103,288 @@ class HuggingFaceFineTuner(Bolt):
         """
         raise NotImplementedError("Subclasses should implement this!")
 
+    def _load_one(self, filepath: str) -> Optional[Union[pa.Table, List[Dict]]]:
+        """
+        Load a single dataset file into an Arrow table.
+
+        While a data extractor lambda is set, dict-shaped sources may return their raw records instead,
+        so the extractor sees them before Arrow has to infer their types.
+
+        Args:
+            filepath (str): The path to the dataset file.
+
+        Returns:
+            Optional[Union[pa.Table, List[Dict]]]: The loaded table or records, or None if the file format is not supported.
+
+        Raises:
+            NotImplementedError: This method should be overridden by subclasses that use `_load_files_as_dataset`.
+        """
+        raise NotImplementedError("Subclasses should implement this!")
+
+    def _load_files_as_dataset(
+        self,
+        dataset_path: str,
+        use_cache: bool = True,
+        normalize_to_parquet: bool = False,
+    ) -> Dataset:
+        """
+        Load all supported files in a directory into a single untokenized dataset.
+
+        Files are read in parallel with `_load_one` and concatenated, or passed record by record through the
+        data extractor lambda when one is set.
+        The result is cached on disk, see `_dataset_cache_path`.
+
+        Args:
+            dataset_path (str): The path to the dataset directory.
+            use_cache (bool, optional): Whether to cache the parsed dataset under `dataset_path/.cache`. Defaults to True.
+            normalize_to_parquet (bool, optional): Whether to write a parquet copy of Excel, XML and YAML files
+                and read that copy on later loads. Defaults to False.
+
+        Returns:
+            Dataset: The loaded dataset.
+        """
+        filepaths = self._dataset_files(dataset_path, normalize_to_parquet=normalize_to_parquet)
+        cache_path = self._dataset_cache_path(dataset_path, filepaths) if use_cache else None
+
+        if cache_path and os.path.exists(cache_path):
+            try:
+                self.log.info(f"Loading cached dataset from {cache_path}")
+                return load_from_disk(cache_path)
+            except Exception as e:
+                self.log.warning(f"Discarding unreadable dataset cache {cache_path}: {e}")
+                shutil.rmtree(cache_path, ignore_errors=True)
+
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 2)) as executor:
+            loaded = list(executor.map(self._load_one, filepaths))
+        if normalize_to_parquet:
+            self._normalize_to_parquet(filepaths, loaded)
+        loaded = [records for records in loaded if records is not None]
+        if not loaded:
+            raise ValueError(f"No supported dataset files found in {dataset_path}")
+
+        if self.data_extractor_lambda:
+            fn = eval(self.data_extractor_lambda)
+            data = []
+            for records in loaded:
+                data.extend(fn(d) for d in (records.to_pylist() if isinstance(records, pa.Table) else records))
+            dataset = Dataset.from_list(data)
+        else:
+            dataset = Dataset(self._concat_tables(dataset_path, loaded))
+
+        if cache_path:
+            self._save_dataset_cache(dataset, cache_path)
+        return dataset
+
+    def _read_sqlite(self, filepath: str, query: str) -> pa.Table:
+        """
+        Run a query against a SQLite dataset file and return the result as an Arrow table.
+
+        The ADBC driver infers each column's type from the first batch of rows and fails when a later row
+        holds another type, which SQLite allows. Such files are read again with pandas, and columns holding
+        mixed types are read as strings, as `_concat_tables` does for columns whose type differs between files.
+
+        Args:
+            filepath (str): The path to the SQLite file.
+            query (str): The query selecting the dataset columns.
+
+        Returns:
+            pa.Table: The query result.
+        """
+        try:
+            with adbc_sqlite.connect(filepath) as conn, conn.cursor() as cursor:
+                cursor.execute(query)
+                return cursor.fetch_arrow_table()
+        except OSError as e:
+            self.log.warning(f"Falling back to pandas to read {filepath}: {e}")
+
+        conn = sqlite3.connect(filepath)
+        try:
+            df = pd.read_sql_query(query, conn)
+        finally:
+            conn.close()
+
+        for column in df.columns[df.dtypes == object]:
+            if df[column].dropna().map(type).nunique() > 1:
+                df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    def _concat_tables(self, dataset_path: str, tables: List[pa.Table]) -> pa.Table:
+        """
+        Concatenate the tables loaded from different files into one.
+
+        Columns missing from a file are filled with nulls. Columns whose type differs between files are cast
+        to a common type: int64 for integers, float64 for mixed numbers and string otherwise.
+
+        Args:
+            dataset_path (str): The path to the dataset directory.
+            tables (List[pa.Table]): The tables loaded from each file.
+
+        Returns:
+            pa.Table: The concatenated table.
+
+        Raises:
+            ValueError: If a column cannot be cast to a common type.
+        """
+        column_types: Dict[str, set] = {}
+        for table in tables:
+            for field in table.schema:
+                if not pa.types.is_null(field.type):
+                    column_types.setdefault(field.name, set()).add(field.type)
+
+        for name, types in column_types.items():
+            if len(types) < 2:
+                continue
+            if all(pa.types.is_integer(t) for t in types):
+                common_type = pa.int64()
+            elif all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+                common_type = pa.float64()
+            else:
+                common_type = pa.string()
+
+            self.log.warning(f"Column {name} has types {types} across files in {dataset_path}, using {common_type}")
+            for i, table in enumerate(tables):
+                if name in table.column_names:
+                    index = table.column_names.index(name)
+                    try:
+                        tables[i] = table.set_column(index, name, table.column(name).cast(common_type))
+                    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                        raise ValueError(
+                            f"Column {name} has incompatible types {types} across files in {dataset_path}: {e}"
+                        ) from e
+
+        return pa.concat_tables(tables, promote=True)
+
+    def _save_dataset_cache(self, dataset: Dataset, cache_path: str) -> None:
+        """
+        Save a dataset to the cache and remove the other cache entries of its directory.
+
+        The dataset is written to a temporary directory first and moved into place once complete,
+        so an interrupted save never leaves a partial entry behind. Failing to write the cache, for example on a
+        read-only dataset directory, is not an error.
+
+        Args:
+            dataset (Dataset): The dataset to cache.
+            cache_path (str): The cache location, see `_dataset_cache_path`.
+        """
+        cache_dir = os.path.dirname(cache_path)
+        tmp_path = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir)
+            dataset.save_to_disk(tmp_path)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            self.log.warning(f"Failed to cache dataset at {cache_path}: {e}")
+            return
+        finally:
+            if tmp_path:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+        # Keep only the entry for the current inputs, older keys would otherwise pile up in the input directory
+        for entry in os.listdir(cache_dir):
+            if entry != os.path.basename(cache_path) and not entry.startswith(".tmp-"):
+                shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+
+    @contextmanager
+    def _tokenizers_parallelism(self, num_proc: Optional[int]) -> Iterator[None]:
+        """
+        Let either the Rust tokenizer threads or the dataset map processes use the cores, but not both.
+
+        The previous value of `TOKENIZERS_PARALLELISM` is restored on exit, so turning tokenizer parallelism off
+        for one multi-process load does not leave later single-process loads, like the eval split, without it.
+
+        Args:
+            num_proc (int, optional): The number of processes the dataset is tokenized with.
+        """
+        previous = os.environ.get("TOKENIZERS_PARALLELISM")
+        if num_proc and num_proc > 1:
+            os.environ["TOKENIZERS_PARALLELISM"] = "false"
+        else:
+            os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+        try:
+            yield
+        finally:
+            if previous is None:
+                os.environ.pop("TOKENIZERS_PARALLELISM", None)
+            else:
+                os.environ["TOKENIZERS_PARALLELISM"] = previous
+
+    def _dataset_files(self, dataset_path: str, normalize_to_parquet: bool = False) -> List[str]:
+        """
+        List the dataset files in a directory.
+
+        A `<file>.parquet` next to an Excel, XML or YAML `<file>` is a copy written by `_normalize_to_parquet`,
+        so only one of the two is ever listed. With `normalize_to_parquet`, an up to date copy replaces its source
+        and a stale one is skipped so the source is read and normalized again. Without it, the source is read.
+
+        Args:
+            dataset_path (str): The path to the dataset directory.
+            normalize_to_parquet (bool, optional): Whether parquet copies replace their sources. Defaults to False.
+
+        Returns:
+            List[str]: The paths of the files to load.
+        """
+        filepaths = [os.path.join(dataset_path, filename) for filename in sorted(os.listdir(dataset_path))]
+        filepaths = [filepath for filepath in filepaths if os.path.isfile(filepath)]
+
+        files = set(filepaths)
+        dataset_files = []
+        for filepath in filepaths:
+            normalized = filepath + ".parquet"
+            source = filepath[: -len(".parquet")]
+            if normalized in files and filepath.endswith(NORMALIZABLE_FORMATS):
+                if normalize_to_parquet and os.path.getmtime(normalized) >= os.path.getmtime(filepath):
+                    continue
+            elif filepath.endswith(".parquet") and source in files and source.endswith(NORMALIZABLE_FORMATS):
+                if not normalize_to_parquet or os.path.getmtime(filepath) < os.path.getmtime(source):
+                    continue
+            dataset_files.append(filepath)
+        return dataset_files
+
+    def _normalize_to_parquet(self, filepaths: List[str], tables: List[Optional[Union[pa.Table, List[Dict]]]]) -> None:
+        """
+        Write a zstd-compressed parquet copy next to each slow-to-parse dataset file.
+
+        Later loads read the copy instead of the source, see `_dataset_files`. The copy is written under a
+        temporary name and moved into place once complete, so a crash never leaves a truncated copy behind.
+
+        Args:
+            filepaths (List[str]): The paths of the loaded files.
+            tables (List[Optional[Union[pa.Table, List[Dict]]]]): The tables loaded from each file, raw records
+                loaded for the data extractor are not normalized.
+        """
+        for filepath, table in zip(filepaths, tables):
+            if isinstance(table, pa.Table) and filepath.endswith(NORMALIZABLE_FORMATS):
+                self.log.info(f"Normalizing {filepath} to parquet")
+                tmp_path = f"{filepath}.parquet.tmp"
+                try:
+                    pq.write_table(table, tmp_path, compression="zstd")
+                    os.replace(tmp_path, filepath + ".parquet")
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+
+    def _dataset_cache_path(self, dataset_path: str, filepaths: List[str]) -> str:
+        """
+        Get the on-disk cache location for a dataset built from the given files.
+
+        The cache key is derived from the names, sizes and modification times of the files,
+        the bolt class and the data extractor lambda, so any change to the inputs misses the cache.
+
+        Args:
+            dataset_path (str): The path to the dataset directory.
+            filepaths (List[str]): The dataset files the dataset is built from.
+
+        Returns:
+            str: The path to the cached dataset under `dataset_path/.cache`.
+        """
+        key = hashlib.blake2b(digest_size=16)
+        key.update(f"{self.__class__.__name__}:{self.data_extractor_lambda}".encode())
+        for filepath in sorted(filepaths):
+            stat = os.stat(filepath)
+            key.update(f"{os.path.basename(filepath)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return os.path.join(dataset_path, ".cache", key.hexdigest())
+
     def preprocess_data(self, **kwargs):
         """Load and preprocess the dataset"""
         try:
@@ -209,7 +504,10 @@ class HuggingFaceFineTuner(Bolt):
             hf_private (bool, optional): Whether to make the repo private. Defaults to True.
             hf_create_pr (bool, optional): Whether to create a pull request. Defaults to False.
             data_extractor_lambda (str, optional): A lambda function run on each data element to extract the actual data.
-            **kwargs: Additional keyword arguments for training.
+            **kwargs: Additional keyword arguments for training. Keys prefixed with `data_`, `training_` and
+                `trainer_` are passed to `load_dataset`, `TrainingArguments` and `Trainer` respectively.
+                If the training dataset has a `length` column, `group_by_length` defaults to True so batches
+                hold examples of similar length; pass `training_group_by_length=False` to disable this.
 
         Raises:
             Exception: If any step in the fine-tuning process fails.
@@ -242,6 +540,12 @@ class HuggingFaceFineTuner(Bolt):
             trainer_kwargs = {k.replace("trainer_", ""): v for k, v in kwargs.items() if "trainer_" in k}
             training_kwargs = {k.replace("training_", ""): v for k, v in kwargs.items() if "training_" in k}
 
+            # Batch samples of similar length together when the dataset exposes a "length" column.
+            # The sampler sorts within shuffled mega-batches (as in RoBERTa), trading a little
+            # batch randomness for much less padding per batch.
+            if isinstance(self.train_dataset, Dataset) and "length" in self.train_dataset.column_names:
+                training_kwargs.setdefault("group_by_length", True)
+
             # Create training arguments
             training_args = TrainingArguments(
                 output_dir=os.path.join(self.output_dir, "model"),
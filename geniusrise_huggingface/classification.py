@@ -16,19 +16,26 @@
 import json
 import logging
 import os
-import sqlite3
-import xml.etree.ElementTree as ET
-from typing import Optional
+from typing import Dict, List, Optional, Union
 
 import pandas as pd
+import pyarrow as pa
 import yaml  # type: ignore
 from datasets import Dataset, load_from_disk
+from lxml import etree
+from pyarrow import csv as pacsv
 from pyarrow import feather
+from pyarrow import json as pajson
 from pyarrow import parquet as pq
 from transformers import DataCollatorWithPadding
 
 from geniusrise_huggingface.base import HuggingFaceFineTuner
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore
+
 
 class HuggingFaceClassificationFineTuner(HuggingFaceFineTuner):
     r"""
@@ -37,6 +44,9 @@ class HuggingFaceClassificationFineTuner(HuggingFaceFineTuner):
     This class extends the `HuggingFaceFineTuner` and specializes in fine-tuning models for text classification.
     It provides additional functionalities for loading and preprocessing text classification datasets in various formats.
 
+    Tokenized examples carry a `length` column, so training batches are grouped by sequence length
+    (`group_by_length=True`) to minimize padding. Pass `training_group_by_length=False` to disable this.
+
     Args:
         input (BatchInput): The batch input data.
         output (OutputConfig): The output data.
@@ -104,13 +114,27 @@ class HuggingFaceClassificationFineTuner(HuggingFaceFineTuner):
         - Feather
     """
 
-    def load_dataset(self, dataset_path: str, max_length: int = 512, **kwargs) -> Optional[Dataset]:
+    def load_dataset(
+        self,
+        dataset_path: str,
+        max_length: int = 512,
+        num_proc: Optional[int] = None,
+        batch_size: int = 4096,
+        use_cache: bool = True,
+        normalize_to_parquet: bool = False,
+        **kwargs,
+    ) -> Optional[Dataset]:
         r"""
         Load a classification dataset from a directory.
 
         Args:
             dataset_path (str): The path to the dataset directory.
             max_length (int, optional): The maximum length for tokenization. Defaults to 512.
+            num_proc (int, optional): The number of processes to tokenize with. Defaults to None (single process).
+            batch_size (int, optional): The number of examples per tokenization batch. Defaults to 4096.
+            use_cache (bool, optional): Whether to cache the parsed dataset under `dataset_path/.cache`. Defaults to True.
+            normalize_to_parquet (bool, optional): Whether to write a parquet copy of Excel, XML and YAML files
+                and read that copy on later loads. Defaults to False.
 
         Returns:
             Dataset: The loaded dataset.
@@ -171,7 +195,13 @@ class HuggingFaceClassificationFineTuner(HuggingFaceFineTuner):
         Should contain 'text' and 'label' columns.
         """
 
-        self.data_collator = DataCollatorWithPadding(tokenizer=self.tokenizer)
+        if self.tokenizer is not None and not getattr(self.tokenizer, "is_fast", False):
+            self.log.warning(
+                f"{self.tokenizer_class} is not a fast tokenizer, dataset tokenization will be slow. "
+                "Use the corresponding *TokenizerFast class or AutoTokenizer if available."
+            )
+
+        self.data_collator = DataCollatorWithPadding(tokenizer=self.tokenizer, pad_to_multiple_of=8)
         self.max_length = max_length
 
         self.label_to_id = self.model.config.label2id if self.model and self.model.config.label2id else None  # type: ignore
@@ -179,88 +209,119 @@ class HuggingFaceClassificationFineTuner(HuggingFaceFineTuner):
         def tokenize_function(examples):
             tokenized_data = self.tokenizer(
                 examples["text"],
-                padding="max_length",
                 truncation=True,
                 max_length=self.max_length,
             )
-            tokenized_data["label"] = [self.label_to_id[label] for label in examples["label"]]
+            tokenized_data["label"] = list(map(self.label_to_id.__getitem__, examples["label"]))
+            tokenized_data["length"] = [len(input_ids) for input_ids in tokenized_data["input_ids"]]
             return tokenized_data
 
-        try:
-            logging.info(f"Loading dataset from {dataset_path}")
-            if os.path.isfile(os.path.join(dataset_path, "dataset_info.json")):
-                # Load dataset saved by Hugging Face datasets library
-                return load_from_disk(dataset_path).map(tokenize_function, batched=True)
-            else:
-                data = []
-                for filename in os.listdir(dataset_path):
-                    filepath = os.path.join(dataset_path, filename)
-                    if filename.endswith(".jsonl"):
-                        with open(filepath, "r") as f:
-                            for line in f:
-                                example = json.loads(line)
-                                data.append(example)
-
-                    elif filename.endswith(".csv"):
-                        df = pd.read_csv(filepath)
-                        data.extend(df.to_dict("records"))
-
-                    elif filename.endswith(".parquet"):
-                        df = pq.read_table(filepath).to_pandas()
-                        data.extend(df.to_dict("records"))
-
-                    elif filename.endswith(".json"):
-                        with open(filepath, "r") as f:
-                            json_data = json.load(f)
-                            data.extend(json_data)
-
-                    elif filename.endswith(".xml"):
-                        tree = ET.parse(filepath)
-                        root = tree.getroot()
-                        for record in root.findall("record"):
-                            text = record.find("text").text  # type: ignore
-                            label = record.find("label").text  # type: ignore
-                            data.append({"text": text, "label": label})
-
-                    elif filename.endswith(".yaml") or filename.endswith(".yml"):
-                        with open(filepath, "r") as f:
-                            yaml_data = yaml.safe_load(f)
-                            data.extend(yaml_data)
-
-                    elif filename.endswith(".tsv"):
-                        df = pd.read_csv(filepath, sep="\t")
-                        data.extend(df.to_dict("records"))
-
-                    elif filename.endswith((".xls", ".xlsx")):
-                        df = pd.read_excel(filepath)
-                        data.extend(df.to_dict("records"))
-
-                    elif filename.endswith(".db"):
-                        conn = sqlite3.connect(filepath)
-                        query = "SELECT text, label FROM dataset_table;"
-                        df = pd.read_sql_query(query, conn)
-                        data.extend(df.to_dict("records"))
-
-                    elif filename.endswith(".feather"):
-                        df = feather.read_feather(filepath)
-                        data.extend(df.to_dict("records"))
-
-                if self.data_extractor_lambda:
-                    fn = eval(self.data_extractor_lambda)
-                    data = [fn(d) for d in data]
+        with self._tokenizers_parallelism(num_proc):
+            try:
+                logging.info(f"Loading dataset from {dataset_path}")
+                if os.path.isfile(os.path.join(dataset_path, "dataset_info.json")):
+                    # Load dataset saved by Hugging Face datasets library
+                    dataset = load_from_disk(dataset_path)
+                    return dataset.map(
+                        tokenize_function,
+                        batched=True,
+                        batch_size=batch_size,
+                        num_proc=num_proc,
+                        remove_columns=dataset.column_names,
+                    )
                 else:
-                    data = data
-
-                # Create label_to_id mapping and save it in model config
-                unique_labels = {example["label"] for example in data}
-                self.label_to_id = {label: i for i, label in enumerate(unique_labels)}
-                if self.model:
-                    if self.model.config.label2id != self.label_to_id:
-                        self.log.warning("New labels detected, ignore if fine-tuning")
-                    self.model.config.label2id = self.label_to_id
-                    self.model.config.id2label = {i: label for label, i in self.label_to_id.items()}
-
-                return Dataset.from_pandas(pd.DataFrame(data)).map(tokenize_function, batched=True)
-        except Exception as e:
-            logging.error(f"Error occurred when loading dataset from {dataset_path}. Error: {e}")
-            raise
+                    dataset = self._load_files_as_dataset(
+                        dataset_path, use_cache=use_cache, normalize_to_parquet=normalize_to_parquet
+                    )
+
+                    # Create label_to_id mapping and save it in model config, sorted so every split gets the same ids
+                    unique_labels = sorted(dataset.unique("label"))
+                    self.label_to_id = {label: i for i, label in enumerate(unique_labels)}
+                    if self.model:
+                        if self.model.config.label2id != self.label_to_id:
+                            self.log.warning("New labels detected, ignore if fine-tuning")
+                        self.model.config.label2id = self.label_to_id
+                        self.model.config.id2label = {i: label for label, i in self.label_to_id.items()}
+
+                    return dataset.map(
+                        tokenize_function,
+                        batched=True,
+                        batch_size=batch_size,
+                        num_proc=num_proc,
+                        remove_columns=dataset.column_names,
+                    )
+            except Exception as e:
+                logging.error(f"Error occurred when loading dataset from {dataset_path}. Error: {e}")
+                raise
+
+    def _load_one(self, filepath: str) -> Optional[Union[pa.Table, List[Dict]]]:
+        r"""
+        Load a single dataset file into an Arrow table.
+
+        Args:
+            filepath (str): The path to the dataset file.
+
+        Returns:
+            Optional[Union[pa.Table, List[Dict]]]: The loaded table, or the raw records of JSON, XML and YAML files
+                while a data extractor lambda is set. None if the file format is not supported.
+        """
+        if filepath.endswith(".jsonl"):
+            if self.data_extractor_lambda:
+                # Keep the raw records, the data extractor may normalize values Arrow cannot type
+                with open(filepath, "r") as f:
+                    return [json.loads(line) for line in f if line.strip()]
+            read_options = pajson.ReadOptions(use_threads=True, block_size=32 << 20)
+            return pajson.read_json(filepath, read_options=read_options)
+
+        elif filepath.endswith(".csv"):
+            read_options = pacsv.ReadOptions(use_threads=True, block_size=32 << 20)
+            parse_options = pacsv.ParseOptions(newlines_in_values=True)
+            return pacsv.read_csv(filepath, read_options=read_options, parse_options=parse_options)
+
+        elif filepath.endswith(".parquet"):
+            return pq.read_table(filepath, use_threads=True)
+
+        elif filepath.endswith(".json"):
+            with open(filepath, "r") as f:
+                json_data = json.load(f)
+                return json_data if self.data_extractor_lambda else pa.Table.from_pylist(json_data)
+
+        elif filepath.endswith(".xml"):
+            data = []
+            # Never expand entities, external ones would pull local files into the dataset
+            for _, record in etree.iterparse(filepath, tag="record", resolve_entities=False):
+                # Like root.findall("record"), only read records that are direct children of the root
+                parent = record.getparent()
+                if parent is None or parent.getparent() is not None:
+                    continue
+                data.append({"text": record.findtext("text"), "label": record.findtext("label")})
+                # Drop parsed records so memory stays constant
+                record.clear()
+                while record.getprevious() is not None:
+                    del parent[0]
+            return data if self.data_extractor_lambda else pa.Table.from_pylist(data)
+
+        elif filepath.endswith(".yaml") or filepath.endswith(".yml"):
+            with open(filepath, "r") as f:
+                yaml_data = yaml.load(f, Loader=SafeLoader)
+                return yaml_data if self.data_extractor_lambda else pa.Table.from_pylist(yaml_data)
+
+        elif filepath.endswith(".tsv"):
+            read_options = pacsv.ReadOptions(use_threads=True, block_size=32 << 20)
+            parse_options = pacsv.ParseOptions(delimiter="\t", newlines_in_values=True)
+            return pacsv.read_csv(filepath, read_options=read_options, parse_options=parse_options)
+
+        elif filepath.endswith((".xls", ".xlsx")):
+            df = pd.read_excel(filepath, engine="calamine")
+            return pa.Table.from_pandas(df, preserve_index=False)
+
+        elif filepath.endswith(".db"):
+            query = "SELECT text, label FROM dataset_table;"
+            return self._read_sqlite(filepath, query)
+
+        elif filepath.endswith(".feather"):
+            # Only read the columns we need, unless a data extractor may want the rest
+            columns = None if self.data_extractor_lambda else ["text", "label"]
+            return feather.read_table(filepath, columns=columns, memory_map=True)
+
+        return None
@@ -15,19 +15,26 @@
 
 import json
 import os
-import sqlite3
-import xml.etree.ElementTree as ET
-from typing import Any, Dict, Union
+from typing import Any, Dict, List, Optional, Union
 
 import pandas as pd
+import pyarrow as pa
 import pyarrow.parquet as pq
 import yaml  # type: ignore
 from datasets import Dataset, DatasetDict, load_from_disk
+from lxml import etree
+from pyarrow import csv as pacsv
 from pyarrow import feather
+from pyarrow import json as pajson
 from transformers import DataCollatorWithPadding
 
 from geniusrise_huggingface.base import HuggingFaceFineTuner
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore
+
 
 class HuggingFaceCommonsenseReasoningFineTuner(HuggingFaceFineTuner):
     r"""
@@ -36,6 +43,9 @@ class HuggingFaceCommonsenseReasoningFineTuner(HuggingFaceFineTuner):
     This class extends the `HuggingFaceFineTuner` and specializes in fine-tuning models for text classification.
     It provides additional functionalities for loading and preprocessing text classification datasets in various formats.
 
+    Tokenized examples carry a `length` column, so training batches are grouped by sequence length
+    (`group_by_length=True`) to minimize padding. Pass `training_group_by_length=False` to disable this.
+
     Args:
         input (BatchInput): The batch input data.
         output (OutputConfig): The output data.
@@ -103,12 +113,25 @@ class HuggingFaceCommonsenseReasoningFineTuner(HuggingFaceFineTuner):
         - Feather
     """
 
-    def load_dataset(self, dataset_path: str, **kwargs: Any) -> Union[Dataset, DatasetDict, None]:
+    def load_dataset(
+        self,
+        dataset_path: str,
+        num_proc: Optional[int] = None,
+        batch_size: int = 4096,
+        use_cache: bool = True,
+        normalize_to_parquet: bool = False,
+        **kwargs: Any,
+    ) -> Union[Dataset, DatasetDict, None]:
         r"""
         Load a commonsense reasoning dataset from a directory.
 
         Args:
             dataset_path (str): The path to the dataset directory.
+            num_proc (int, optional): The number of processes to tokenize with. Defaults to None (single process).
+            batch_size (int, optional): The number of examples per tokenization batch. Defaults to 4096.
+            use_cache (bool, optional): Whether to cache the parsed dataset under `dataset_path/.cache`. Defaults to True.
+            normalize_to_parquet (bool, optional): Whether to write a parquet copy of Excel, XML and YAML files
+                and read that copy on later loads. Defaults to False.
             **kwargs: Additional keyword arguments.
 
         Returns:
@@ -175,76 +198,107 @@ class HuggingFaceCommonsenseReasoningFineTuner(HuggingFaceFineTuner):
         Should contain 'premise', 'hypothesis', and 'label' columns.
         """
 
-        try:
-            if os.path.isfile(os.path.join(dataset_path, "dataset_info.json")):
-                dataset = load_from_disk(dataset_path)
-                return dataset.map(
-                    self.prepare_train_features,
-                    batched=True,
-                    remove_columns=dataset.column_names,
-                )
-            else:
-                data = []
-                for filename in os.listdir(dataset_path):
-                    filepath = os.path.join(dataset_path, filename)
-                    if filename.endswith(".jsonl"):
-                        with open(filepath, "r") as f:
-                            for line in f:
-                                example = json.loads(line)
-                                data.append(example)
-                    elif filename.endswith(".csv"):
-                        df = pd.read_csv(filepath)
-                        data.extend(df.to_dict("records"))
-                    elif filename.endswith(".parquet"):
-                        df = pq.read_table(filepath).to_pandas()
-                        data.extend(df.to_dict("records"))
-                    elif filename.endswith(".json"):
-                        with open(filepath, "r") as f:
-                            data.extend(json.load(f))
-                    elif filename.endswith(".xml"):
-                        tree = ET.parse(filepath)
-                        root = tree.getroot()
-                        for record in root.findall("record"):
-                            example = {
-                                "premise": record.find("premise").text,  # type: ignore
-                                "hypothesis": record.find("hypothesis").text,  # type: ignore
-                                "label": int(record.find("label").text),  # type: ignore
-                            }
-                            data.append(example)
-                    elif filename.endswith((".yaml", ".yml")):
-                        with open(filepath, "r") as f:
-                            data.extend(yaml.safe_load(f))
-                    elif filename.endswith(".tsv"):
-                        df = pd.read_csv(filepath, sep="\t")
-                        data.extend(df.to_dict("records"))
-                    elif filename.endswith((".xls", ".xlsx")):
-                        df = pd.read_excel(filepath)
-                        data.extend(df.to_dict("records"))
-                    elif filename.endswith(".db"):
-                        conn = sqlite3.connect(filepath)
-                        query = "SELECT premise, hypothesis, label FROM dataset_table;"
-                        df = pd.read_sql_query(query, conn)
-                        data.extend(df.to_dict("records"))
-                    elif filename.endswith(".feather"):
-                        df = feather.read_feather(filepath)
-                        data.extend(df.to_dict("records"))
-
-                if self.data_extractor_lambda:
-                    fn = eval(self.data_extractor_lambda)
-                    data = [fn(d) for d in data]
+        if self.tokenizer is not None and not getattr(self.tokenizer, "is_fast", False):
+            self.log.warning(
+                f"{self.tokenizer_class} is not a fast tokenizer, dataset tokenization will be slow. "
+                "Use the corresponding *TokenizerFast class or AutoTokenizer if available."
+            )
+
+        with self._tokenizers_parallelism(num_proc):
+            try:
+                if os.path.isfile(os.path.join(dataset_path, "dataset_info.json")):
+                    dataset = load_from_disk(dataset_path)
+                    return dataset.map(
+                        self.prepare_train_features,
+                        batched=True,
+                        batch_size=batch_size,
+                        num_proc=num_proc,
+                        remove_columns=dataset.column_names,
+                    )
                 else:
-                    data = data
+                    dataset = self._load_files_as_dataset(
+                        dataset_path, use_cache=use_cache, normalize_to_parquet=normalize_to_parquet
+                    )
+
+                    return dataset.map(
+                        self.prepare_train_features,
+                        batched=True,
+                        batch_size=batch_size,
+                        num_proc=num_proc,
+                        remove_columns=dataset.column_names,
+                    )
+
+            except Exception as e:
+                print(f"Error loading dataset: {e}")
+                raise
+
+    def _load_one(self, filepath: str) -> Optional[Union[pa.Table, List[Dict]]]:
+        """
+        Load a single dataset file into an Arrow table.
 
-                dataset = Dataset.from_pandas(pd.DataFrame(data))
-                return dataset.map(
-                    self.prepare_train_features,
-                    batched=True,
-                    remove_columns=dataset.column_names,
-                )
+        Args:
+            filepath (str): The path to the dataset file.
 
-        except Exception as e:
-            print(f"Error loading dataset: {e}")
-            raise
+        Returns:
+            Optional[Union[pa.Table, List[Dict]]]: The loaded table, or the raw records of JSON, XML and YAML files
+                while a data extractor lambda is set. None if the file format is not supported.
+        """
+        if filepath.endswith(".jsonl"):
+            if self.data_extractor_lambda:
+                # Keep the raw records, the data extractor may normalize values Arrow cannot type
+                with open(filepath, "r") as f:
+                    return [json.loads(line) for line in f if line.strip()]
+            read_options = pajson.ReadOptions(use_threads=True, block_size=32 << 20)
+            return pajson.read_json(filepath, read_options=read_options)
+        elif filepath.endswith(".csv"):
+            read_options = pacsv.ReadOptions(use_threads=True, block_size=32 << 20)
+            parse_options = pacsv.ParseOptions(newlines_in_values=True)
+            return pacsv.read_csv(filepath, read_options=read_options, parse_options=parse_options)
+        elif filepath.endswith(".parquet"):
+            return pq.read_table(filepath, use_threads=True)
+        elif filepath.endswith(".json"):
+            with open(filepath, "r") as f:
+                data = json.load(f)
+                return data if self.data_extractor_lambda else pa.Table.from_pylist(data)
+        elif filepath.endswith(".xml"):
+            data = []
+            # Never expand entities, external ones would pull local files into the dataset
+            for _, record in etree.iterparse(filepath, tag="record", resolve_entities=False):
+                # Like root.findall("record"), only read records that are direct children of the root
+                parent = record.getparent()
+                if parent is None or parent.getparent() is not None:
+                    continue
+                example = {
+                    "premise": record.findtext("premise"),
+                    "hypothesis": record.findtext("hypothesis"),
+                    "label": int(record.findtext("label")),  # type: ignore
+                }
+                data.append(example)
+                # Drop parsed records so memory stays constant
+                record.clear()
+                while record.getprevious() is not None:
+                    del parent[0]
+            return data if self.data_extractor_lambda else pa.Table.from_pylist(data)
+        elif filepath.endswith((".yaml", ".yml")):
+            with open(filepath, "r") as f:
+                data = yaml.load(f, Loader=SafeLoader)
+                return data if self.data_extractor_lambda else pa.Table.from_pylist(data)
+        elif filepath.endswith(".tsv"):
+            read_options = pacsv.ReadOptions(use_threads=True, block_size=32 << 20)
+            parse_options = pacsv.ParseOptions(delimiter="\t", newlines_in_values=True)
+            return pacsv.read_csv(filepath, read_options=read_options, parse_options=parse_options)
+        elif filepath.endswith((".xls", ".xlsx")):
+            df = pd.read_excel(filepath, engine="calamine")
+            return pa.Table.from_pandas(df, preserve_index=False)
+        elif filepath.endswith(".db"):
+            query = "SELECT premise, hypothesis, label FROM dataset_table;"
+            return self._read_sqlite(filepath, query)
+        elif filepath.endswith(".feather"):
+            # Only read the columns we need, unless a data extractor may want the rest
+            columns = None if self.data_extractor_lambda else ["premise", "hypothesis", "label"]
+            return feather.read_table(filepath, columns=columns, memory_map=True)
+
+        return None
 
     def prepare_train_features(self, examples: Dict) -> Dict:
         """
@@ -271,6 +325,9 @@ class HuggingFaceCommonsenseReasoningFineTuner(HuggingFaceFineTuner):
             # Prepare the labels
             tokenized_inputs["labels"] = examples["label"]
 
+            # Sequence lengths, used to batch examples of similar length together
+            tokenized_inputs["length"] = [len(input_ids) for input_ids in tokenized_inputs["input_ids"]]
+
             return tokenized_inputs
         except Exception as e:
             print(f"Error preparing train features: {e}")
@@ -287,7 +344,11 @@ class HuggingFaceCommonsenseReasoningFineTuner(HuggingFaceFineTuner):
             dict: The collated data.
         """
         try:
-            return DataCollatorWithPadding(self.tokenizer)(examples)
+            # Build the collator once per tokenizer instead of on every batch
+            collator = getattr(self, "_collator", None)
+            if collator is None or collator.tokenizer is not self.tokenizer:
+                collator = self._collator = DataCollatorWithPadding(self.tokenizer, pad_to_multiple_of=8)
+            return collator(examples)
 
         except Exception as e:
             print(f"Error in data collation: {e}")
@@ -14,12 +14,17 @@
 # limitations under the License.
 
 import os
+import sqlite3
 import tempfile
 
 import numpy as np
+import pyarrow as pa
 import pytest
-from datasets import load_dataset
+import yaml  # type: ignore
+from datasets import Dataset, load_dataset
 from geniusrise.core import BatchInput, BatchOutput, InMemoryState
+from pyarrow import csv as pacsv
+from pyarrow import parquet as pq
 from transformers import EvalPrediction
 
 from geniusrise_huggingface.base import HuggingFaceFineTuner
@@ -42,8 +47,19 @@ class TestHuggingFaceFineTuner(HuggingFaceFineTuner):
         return dataset
 
 
-@pytest.fixture
-def bolt():
+class FileLoaderFineTuner(TestHuggingFaceFineTuner):
+    def _load_one(self, filepath):
+        if filepath.endswith(".csv"):
+            return pacsv.read_csv(filepath)
+        elif filepath.endswith(".parquet"):
+            return pq.read_table(filepath)
+        elif filepath.endswith(".yaml"):
+            with open(filepath) as f:
+                return pa.Table.from_pylist(yaml.safe_load(f))
+        return None
+
+
+def create_bolt(klass):
     input_dir = tempfile.mkdtemp()
     output_dir = tempfile.mkdtemp()
 
@@ -51,7 +67,7 @@ def bolt():
     output = BatchOutput(output_dir, "geniusrise-test-bucket", "test-🤗-output")
     state = InMemoryState()
 
-    return TestHuggingFaceFineTuner(
+    return klass(
         input=input,
         output=output,
         state=state,
@@ -59,6 +75,37 @@ def bolt():
     )
 
 
+@pytest.fixture
+def bolt():
+    return create_bolt(TestHuggingFaceFineTuner)
+
+
+@pytest.fixture
+def file_loader_bolt():
+    return create_bolt(FileLoaderFineTuner)
+
+
+def create_dataset_files(directory, ext):
+    data = [{"text": f"text_{i}", "label": f"label_{i % 2}"} for i in range(10)]
+    if ext == "csv":
+        pacsv.write_csv(pa.Table.from_pylist(data), os.path.join(directory, "data.csv"))
+    elif ext == "yaml":
+        with open(os.path.join(directory, "data.yaml"), "w") as f:
+            yaml.dump(data, f)
+
+
+def count_loads(bolt, monkeypatch):
+    loads = []
+    load_one = bolt._load_one
+
+    def _load_one(filepath):
+        loads.append(filepath)
+        return load_one(filepath)
+
+    monkeypatch.setattr(bolt, "_load_one", _load_one)
+    return loads
+
+
 def test_bolt_init(bolt):
     assert bolt.input is not None
     assert bolt.output is not None
@@ -124,3 +171,174 @@ def test_upload_to_hf_hub(bolt):
     )
 
     assert True
+
+
+class FakeTrainer:
+    def __init__(self, args, **kwargs):
+        FakeTrainer.args = args
+
+    def train(self):
+        pass
+
+    def save_model(self):
+        pass
+
+
+@pytest.mark.parametrize(
+    "columns, kwargs, group_by_length",
+    [
+        (["input_ids", "length"], {}, True),
+        (["input_ids", "length"], {"training_group_by_length": False}, False),
+        (["input_ids"], {}, False),
+    ],
+)
+def test_fine_tune_group_by_length(bolt, monkeypatch, columns, kwargs, group_by_length):
+    def preprocess_data(**kwargs):
+        data = {"input_ids": [[101, 102], [101, 7, 102]], "length": [2, 3]}
+        bolt.train_dataset = Dataset.from_dict({column: data[column] for column in columns})
+
+    monkeypatch.setattr(bolt, "load_models", lambda: None)
+    monkeypatch.setattr(bolt, "preprocess_data", preprocess_data)
+    monkeypatch.setattr("geniusrise_huggingface.base.Trainer", FakeTrainer)
+
+    bolt.fine_tune(
+        model_name="bert-base-uncased",
+        tokenizer_name="bert-base-uncased",
+        num_train_epochs=1,
+        per_device_train_batch_size=1,
+        **kwargs,
+    )
+    assert FakeTrainer.args.group_by_length is group_by_length
+
+
+def test_load_files_as_dataset_cache_hit(tmpdir, file_loader_bolt, monkeypatch):
+    create_dataset_files(tmpdir, "csv")
+    loads = count_loads(file_loader_bolt, monkeypatch)
+
+    first = file_loader_bolt._load_files_as_dataset(tmpdir)
+    second = file_loader_bolt._load_files_as_dataset(tmpdir)
+    assert len(loads) == 1
+    assert second.to_list() == first.to_list()
+    assert len(os.listdir(os.path.join(tmpdir, ".cache"))) == 1
+
+
+def test_load_files_as_dataset_cache_miss_on_change(tmpdir, file_loader_bolt, monkeypatch):
+    create_dataset_files(tmpdir, "csv")
+    filepath = os.path.join(tmpdir, "data.csv")
+    loads = count_loads(file_loader_bolt, monkeypatch)
+    file_loader_bolt._load_files_as_dataset(tmpdir)
+
+    # Same size, newer modification time
+    stat = os.stat(filepath)
+    os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    file_loader_bolt._load_files_as_dataset(tmpdir)
+    assert len(loads) == 2
+
+    # Different size
+    with open(filepath) as f:
+        rows = f.readlines()
+    with open(filepath, "a") as f:
+        f.write(rows[-1])
+    assert len(file_loader_bolt._load_files_as_dataset(tmpdir)) == 11
+    assert len(loads) == 3
+
+    # Different data extractor
+    file_loader_bolt.data_extractor_lambda = "lambda x: x"
+    file_loader_bolt._load_files_as_dataset(tmpdir)
+    assert len(loads) == 4
+
+    # Old entries are pruned
+    assert len(os.listdir(os.path.join(tmpdir, ".cache"))) == 1
+
+
+def test_load_files_as_dataset_cache_corrupt(tmpdir, file_loader_bolt, monkeypatch):
+    create_dataset_files(tmpdir, "csv")
+    file_loader_bolt._load_files_as_dataset(tmpdir)
+    cache_path = file_loader_bolt._dataset_cache_path(tmpdir, file_loader_bolt._dataset_files(tmpdir))
+
+    # Simulate an entry left behind by an interrupted save
+    for filename in os.listdir(cache_path):
+        with open(os.path.join(cache_path, filename), "w") as f:
+            f.write("garbage")
+
+    loads = count_loads(file_loader_bolt, monkeypatch)
+    assert len(file_loader_bolt._load_files_as_dataset(tmpdir)) == 10
+    assert len(loads) == 1
+    assert len(file_loader_bolt._load_files_as_dataset(tmpdir)) == 10
+    assert len(loads) == 1
+
+
+def test_load_files_as_dataset_cache_not_writable(tmpdir, file_loader_bolt, monkeypatch):
+    create_dataset_files(tmpdir, "csv")
+
+    def mkdtemp(*args, **kwargs):
+        raise PermissionError("Read-only file system")
+
+    # A read-only dataset directory only skips the cache
+    monkeypatch.setattr("geniusrise_huggingface.base.tempfile.mkdtemp", mkdtemp)
+    assert len(file_loader_bolt._load_files_as_dataset(tmpdir)) == 10
+
+
+def test_load_files_as_dataset_normalize_to_parquet(tmpdir, file_loader_bolt, monkeypatch):
+    create_dataset_files(tmpdir, "yaml")
+    source = os.path.join(tmpdir, "data.yaml")
+    normalized = source + ".parquet"
+    loads = count_loads(file_loader_bolt, monkeypatch)
+
+    # First load reads the source and writes the copy
+    first = file_loader_bolt._load_files_as_dataset(tmpdir, use_cache=False, normalize_to_parquet=True)
+    assert loads == [source]
+    assert os.path.isfile(normalized)
+
+    # Later loads read the copy
+    second = file_loader_bolt._load_files_as_dataset(tmpdir, use_cache=False, normalize_to_parquet=True)
+    assert loads[1:] == [normalized]
+    assert second.to_list() == first.to_list()
+
+    # A copy older than its source is stale, the source is read and normalized again
+    stat = os.stat(source)
+    os.utime(normalized, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+    assert len(file_loader_bolt._load_files_as_dataset(tmpdir, use_cache=False, normalize_to_parquet=True)) == 10
+    assert loads[2:] == [source]
+    assert os.path.getmtime(normalized) >= os.path.getmtime(source)
+
+    # Without the flag the source is read, never both the source and its copy
+    assert len(file_loader_bolt._load_files_as_dataset(tmpdir, use_cache=False)) == 10
+    assert loads[3:] == [source]
+
+
+def test_read_sqlite_mixed_column_types(tmpdir, file_loader_bolt):
+    # SQLite columns can hold mixed types, here past the first batch of rows the driver infers types from
+    filepath = os.path.join(tmpdir, "data.db")
+    conn = sqlite3.connect(filepath)
+    conn.execute("CREATE TABLE dataset_table (text, label)")
+    rows = [(f"text_{i}", i % 2) for i in range(3000)] + [("text_3000", "neutral"), ("text_3001", None)]
+    conn.executemany("INSERT INTO dataset_table VALUES (?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    table = file_loader_bolt._read_sqlite(filepath, "SELECT text, label FROM dataset_table;")
+    assert table.num_rows == 3002
+    assert table.column("label").to_pylist()[-4:] == ["0", "1", "neutral", None]
+
+
+def test_tokenizers_parallelism_restored(bolt, monkeypatch):
+    monkeypatch.delenv("TOKENIZERS_PARALLELISM", raising=False)
+
+    # Several map processes turn tokenizer parallelism off only while they run
+    with bolt._tokenizers_parallelism(4):
+        assert os.environ["TOKENIZERS_PARALLELISM"] == "false"
+    assert "TOKENIZERS_PARALLELISM" not in os.environ
+
+    # A later single-process load, like the eval split, uses the tokenizer threads again
+    with bolt._tokenizers_parallelism(None):
+        assert os.environ["TOKENIZERS_PARALLELISM"] == "true"
+
+    # A value set by the user is kept for single-process loads and restored afterwards
+    monkeypatch.setenv("TOKENIZERS_PARALLELISM", "false")
+    with bolt._tokenizers_parallelism(None):
+        assert os.environ["TOKENIZERS_PARALLELISM"] == "false"
+    monkeypatch.setenv("TOKENIZERS_PARALLELISM", "true")
+    with bolt._tokenizers_parallelism(4):
+        assert os.environ["TOKENIZERS_PARALLELISM"] == "false"
+    assert os.environ["TOKENIZERS_PARALLELISM"] == "true"
@@ -137,6 +137,71 @@ def test_load_dataset_all_formats(classification_bolt, dataset_file):
     assert len(dataset) == 10
 
 
+def test_load_dataset_empty_directory(tmpdir, classification_bolt):
+    with pytest.raises(ValueError, match="No supported dataset files"):
+        classification_bolt.load_dataset(str(tmpdir))
+
+
+def test_load_dataset_extractor_sees_raw_records(tmpdir, classification_bolt):
+    # Arrow cannot type "meta", the data extractor drops it before the dataset is built
+    with open(os.path.join(tmpdir, "data.jsonl"), "w") as f:
+        for i in range(10):
+            f.write(json.dumps({"text": f"text_{i}", "label": f"label_{i % 2}", "meta": {"k": 1 if i % 2 else "s"}}) + "\n")
+    classification_bolt.data_extractor_lambda = "lambda x: {'text': x['text'], 'label': x['label']}"
+
+    dataset = classification_bolt._load_files_as_dataset(tmpdir)
+    assert len(dataset) == 10
+    assert sorted(dataset.column_names) == ["label", "text"]
+
+
+def test_load_dataset_mixed_column_types(tmpdir, classification_bolt):
+    pd.DataFrame([{"text": f"text_{i}", "label": i % 2} for i in range(10)]).to_csv(
+        os.path.join(tmpdir, "data.csv"), index=False
+    )
+    with open(os.path.join(tmpdir, "data.json"), "w") as f:
+        json.dump([{"text": f"text_{i}", "label": f"label_{i % 2}"} for i in range(10)], f)
+
+    dataset = classification_bolt._load_files_as_dataset(tmpdir)
+    assert len(dataset) == 20
+    assert set(dataset.unique("label")) == {"0", "1", "label_0", "label_1"}
+
+
+def test_load_dataset_label_ids_stable_across_splits(tmpdir, classification_bolt):
+    classification_bolt.load_models()
+    label_to_ids = []
+    for split, labels in [("train", ["pos", "neg", "pos"]), ("eval", ["neg", "pos"])]:
+        os.makedirs(os.path.join(tmpdir, split))
+        with open(os.path.join(tmpdir, split, "data.json"), "w") as f:
+            json.dump([{"text": f"text_{i}", "label": label} for i, label in enumerate(labels)], f)
+        classification_bolt.load_dataset(os.path.join(tmpdir, split))
+        label_to_ids.append(classification_bolt.label_to_id)
+
+    assert label_to_ids[0] == label_to_ids[1] == {"neg": 0, "pos": 1}
+
+
+def test_load_dataset_xml_top_level_records(tmpdir, classification_bolt):
+    # Records nested below the root's children are skipped and external entities are never expanded
+    secret = os.path.join(tmpdir, "secret.txt")
+    with open(secret, "w") as f:
+        f.write("secret")
+    with open(os.path.join(tmpdir, "data.xml"), "w") as f:
+        f.write(
+            f"""<?xml version="1.0"?>
+<!DOCTYPE root [<!ENTITY secret SYSTEM "file://{secret}">]>
+<root>
+    <record><text>text_0&secret;</text><label>label_0</label></record>
+    <group><record><text>nested</text><label>label_1</label></record></group>
+    <record><text>text_1</text><label>label_1</label></record>
+</root>"""
+        )
+
+    dataset = classification_bolt._load_files_as_dataset(tmpdir)
+    assert dataset.to_list() == [
+        {"text": "text_0", "label": "label_0"},
+        {"text": "text_1", "label": "label_1"},
+    ]
+
+
 # Test for fine-tuning
 def test_classification_bolt_fine_tune(classification_bolt, dataset_file):
     tmpdir, ext = dataset_file
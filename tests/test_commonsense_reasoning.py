@@ -138,6 +138,47 @@ def test_load_dataset_all_formats(commonsense_bolt, dataset_file):
     assert len(dataset) == 10
 
 
+def test_load_dataset_empty_directory(tmpdir, commonsense_bolt):
+    with pytest.raises(ValueError, match="No supported dataset files"):
+        commonsense_bolt.load_dataset(str(tmpdir))
+
+
+def test_load_dataset_extractor_sees_raw_records(tmpdir, commonsense_bolt):
+    # Arrow cannot type "meta", the data extractor drops it before the dataset is built
+    with open(os.path.join(tmpdir, "data.jsonl"), "w") as f:
+        for i in range(10):
+            example = {"premise": f"premise_{i}", "hypothesis": f"hypothesis_{i}", "label": i % 3}
+            f.write(json.dumps({**example, "meta": {"k": 1 if i % 2 else "s"}}) + "\n")
+    commonsense_bolt.data_extractor_lambda = "lambda x: {k: v for k, v in x.items() if k != 'meta'}"
+
+    dataset = commonsense_bolt._load_files_as_dataset(tmpdir)
+    assert len(dataset) == 10
+    assert sorted(dataset.column_names) == ["hypothesis", "label", "premise"]
+
+
+def test_load_dataset_xml_top_level_records(tmpdir, commonsense_bolt):
+    # Records nested below the root's children are skipped and external entities are never expanded
+    secret = os.path.join(tmpdir, "secret.txt")
+    with open(secret, "w") as f:
+        f.write("secret")
+    with open(os.path.join(tmpdir, "data.xml"), "w") as f:
+        f.write(
+            f"""<?xml version="1.0"?>
+<!DOCTYPE root [<!ENTITY secret SYSTEM "file://{secret}">]>
+<root>
+    <record><premise>premise_0&secret;</premise><hypothesis>hypothesis_0</hypothesis><label>0</label></record>
+    <group><record><premise>nested</premise><hypothesis>nested</hypothesis><label>1</label></record></group>
+    <record><premise>premise_1</premise><hypothesis>hypothesis_1</hypothesis><label>1</label></record>
+</root>"""
+        )
+
+    dataset = commonsense_bolt._load_files_as_dataset(tmpdir)
+    assert dataset.to_list() == [
+        {"premise": "premise_0", "hypothesis": "hypothesis_0", "label": 0},
+        {"premise": "premise_1", "hypothesis": "hypothesis_1", "label": 1},
+    ]
+
+
 # Test for fine-tuning
 def test_commonsense_bolt_fine_tune(commonsense_bolt, dataset_file):
     tmpdir, ext = dataset_file
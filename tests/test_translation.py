@@ -110,11 +110,11 @@ def dataset_file(request, tmpdir):
     return tmpdir, ext
 
 
-@pytest.fixture
-def translation_bolt():
-    input_dir = tempfile.mkdtemp()
-    output_dir = tempfile.mkdtemp()
+# A tiny Marian checkpoint keeps model loading and fine-tuning fast, the language pair does not matter here
+MODEL_NAME = "sshleifer/tiny-marian-en-de"
+
 
+def create_translation_bolt(input_dir, output_dir):
     input = BatchInput(input_dir, "geniusrise-test-bucket", "test-🤗-input")
     output = BatchOutput(output_dir, "geniusrise-test-bucket", "test-🤗-output")
     state = InMemoryState()
@@ -126,15 +126,21 @@ def translation_bolt():
         eval=True,
     )
     klass.model_class = "MarianMTModel"
-    klass.model_name = "Helsinki-NLP/opus-mt-en-fr"
+    klass.model_name = MODEL_NAME
     klass.tokenizer_class = "MarianTokenizer"
-    klass.tokenizer_name = "Helsinki-NLP/opus-mt-en-fr"
+    klass.tokenizer_name = MODEL_NAME
     return klass
 
 
-def test_translation_bolt_init(translation_bolt):
-    translation_bolt.load_models()
+# Loading the model is the slow part, so load it once and share the bolt across the session
+@pytest.fixture(scope="session")
+def translation_bolt():
+    klass = create_translation_bolt(tempfile.mkdtemp(), tempfile.mkdtemp())
+    klass.load_models()
+    return klass
+
 
+def test_translation_bolt_init(translation_bolt):
     assert translation_bolt.model is not None
     assert translation_bolt.tokenizer is not None
     assert translation_bolt.input is not None
@@ -146,19 +152,19 @@ def test_load_dataset_all_formats(translation_bolt, dataset_file):
     tmpdir, ext = dataset_file
     dataset_path = os.path.join(tmpdir, "train")
 
-    translation_bolt.load_models()
     dataset = translation_bolt.load_dataset(dataset_path)
     assert dataset is not None
     assert len(dataset) == 10
 
 
-def test_translation_bolt_fine_tune(translation_bolt, dataset_file):
+def test_translation_bolt_fine_tune(dataset_file):
     tmpdir, ext = dataset_file
-    translation_bolt.input.input_folder = tmpdir
+    # Fine-tuning changes the model, so use a fresh bolt rather than the shared one
+    translation_bolt = create_translation_bolt(tmpdir, tempfile.mkdtemp())
 
     translation_bolt.fine_tune(
-        model_name="Helsinki-NLP/opus-mt-en-fr",
-        tokenizer_name="Helsinki-NLP/opus-mt-en-fr",
+        model_name=MODEL_NAME,
+        tokenizer_name=MODEL_NAME,
         model_class="MarianMTModel",
         tokenizer_class="MarianTokenizer",
         num_train_epochs=1,